@@ -1,9 +1,10 @@
 import os
 os.environ["IMAGEIO_FFMPEG_EXE"] = "/usr/bin/ffmpeg"
 
-from fastapi import FastAPI, UploadFile, File, Form, Body
+from fastapi import FastAPI, UploadFile, File, Form, Body, Request
 from fastapi.responses import JSONResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.staticfiles import NotModifiedResponse
 import subprocess
 import whisper
 from whisper.utils import get_writer
@@ -42,7 +43,8 @@ app = FastAPI(
 )
 
 # Monta pasta estática para acessar os arquivos gerados
-app.mount("/output", StaticFiles(directory="/workspace/output"), name="output")
+arquivos_output = StaticFiles(directory="/workspace/output")
+app.mount("/output", arquivos_output, name="output")
 
 # ======================
 # 📂 CONFIGURAÇÕES DE DIRETÓRIO
@@ -191,6 +193,42 @@ async def upload_file(
     except Exception as e:
         return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
 
+# ========================
+# 📡 Saída progressiva (HLS / fMP4)
+# ========================
+HLS_PLAYLIST = "index.m3u8"
+
+def parametros_hls(hls_dir: str, hls_time: int = 4) -> list:
+    """
+    Parâmetros FFmpeg para gravar HLS com segmentos fMP4 durante o encode.
+    A playlist é do tipo 'event': novos segmentos são anexados conforme
+    ficam prontos e o #EXT-X-ENDLIST só aparece ao final da renderização.
+    """
+    return [
+        # Keyframe a cada hls_time segundos → segmentos com duração estável
+        "-force_key_frames", f"expr:gte(t,n_forced*{hls_time})",
+        "-f", "hls",
+        "-hls_time", str(hls_time),
+        "-hls_playlist_type", "event",
+        "-hls_segment_type", "fmp4",
+        "-hls_fmp4_init_filename", "init.mp4",
+        "-hls_segment_filename", os.path.join(hls_dir, "seg_%05d.m4s"),
+        # temp_file: segmento só aparece na playlist depois de completo
+        "-hls_flags", "independent_segments+temp_file",
+    ]
+
+def tamanho_mb(path: str) -> float:
+    """Tamanho em MB de um arquivo ou da soma dos arquivos de um diretório."""
+    if os.path.isdir(path):
+        total = sum(
+            os.path.getsize(os.path.join(path, item))
+            for item in os.listdir(path)
+            if os.path.isfile(os.path.join(path, item))
+        )
+    else:
+        total = os.path.getsize(path)
+    return round(total / (1024 * 1024), 2)
+
 # ========================
 #  Ken Burns Sei lá
 # ========================
@@ -207,14 +245,34 @@ async def gerar_video_kenburns_simples(
     fade: bool = Form(True),
     audio_delay: float = Form(0.0),
     codec: str = Form("h264_nvenc"),
-    preset: str = Form("p5")
+    preset: str = Form("p5"),
+    output_mode: str = Form("mp4"),
+    hls_time: int = Form(4)
 ):
     """
     Gera vídeo com efeito Ken Burns leve (zoom + pan suave via MoviePy),
     processando em background (não bloqueia a requisição HTTP)
     e grava status em arquivo JSON.
+    - output_mode="mp4": arquivo único, disponível ao final.
+    - output_mode="hls": playlist HLS com segmentos fMP4 gravados durante
+      o encode, para iniciar a reprodução antes do fim da renderização.
     """
+    output_mode = output_mode.lower()
+    if output_mode not in ("mp4", "hls"):
+        return JSONResponse(
+            {"error": f"output_mode inválido: {output_mode} (use 'mp4' ou 'hls')."},
+            status_code=400
+        )
+    if hls_time <= 0:
+        return JSONResponse(
+            {"error": "hls_time deve ser maior que zero."},
+            status_code=400
+        )
+
     status_path = os.path.join(OUTPUT_DIR, f"{Path(output_name).stem}_status.json")
+    modo_hls = output_mode == "hls"
+    hls_dir = os.path.join(OUTPUT_DIR, f"{Path(output_name).stem}_hls")
+    playlist_url = f"/output/{Path(output_name).stem}_hls/{HLS_PLAYLIST}"
 
     def salvar_status(data: dict):
         """Atualiza arquivo de status JSON no disco."""
@@ -223,13 +281,28 @@ async def gerar_video_kenburns_simples(
 
     def render_task():
         try:
-            salvar_status({"status": "processing", "output": output_name})
+            if modo_hls:
+                salvar_status({"status": "processing", "output": output_name, "playlist": playlist_url})
+            else:
+                salvar_status({"status": "processing", "output": output_name})
 
             audio_path = os.path.join(UPLOAD_DIR, audio_file)
             imagens_glob = os.path.join(UPLOAD_DIR, image_pattern)
             output_path = os.path.join(OUTPUT_DIR, output_name)
             os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+            ffmpeg_params = ["-pix_fmt", "yuv420p", "-vsync", "1"]
+            temp_audiofile = None
+            if modo_hls:
+                # Segmentos são gravados pelo próprio encoder → playlist cresce em tempo real
+                shutil.rmtree(hls_dir, ignore_errors=True)
+                os.makedirs(hls_dir, exist_ok=True)
+                output_path = os.path.join(hls_dir, HLS_PLAYLIST)
+                ffmpeg_params += parametros_hls(hls_dir, hls_time)
+                # O MoviePy nomeia o áudio temporário pelo basename da saída
+                # (sempre "index") → cada job usa o próprio diretório
+                temp_audiofile = os.path.join(hls_dir, "audio_tmp.m4a")
+
             imagens = sorted(glob.glob(imagens_glob))
             if not imagens:
                 salvar_status({"status": "error", "message": f"Nenhuma imagem encontrada em {imagens_glob}"})
@@ -305,16 +378,25 @@ async def gerar_video_kenburns_simples(
                 codec=codec,
                 audio_codec="aac",
                 preset=preset,
-                ffmpeg_params=["-pix_fmt", "yuv420p", "-vsync", "1"],
+                ffmpeg_params=ffmpeg_params,
+                temp_audiofile=temp_audiofile,
                 threads=2,
                 logger=None
             )
 
-            salvar_status({
-                "status": "done",
-                "output": output_name,
-                "tamanho_mb": round(os.path.getsize(output_path) / (1024 * 1024), 2)
-            })
+            if modo_hls:
+                salvar_status({
+                    "status": "done",
+                    "output": output_name,
+                    "playlist": playlist_url,
+                    "tamanho_mb": tamanho_mb(hls_dir)
+                })
+            else:
+                salvar_status({
+                    "status": "done",
+                    "output": output_name,
+                    "tamanho_mb": tamanho_mb(output_path)
+                })
             print(f"✅ Vídeo concluído: {output_path}")
 
         except Exception as e:
@@ -323,12 +405,15 @@ async def gerar_video_kenburns_simples(
 
     Thread(target=render_task).start()
 
-    return JSONResponse({
+    resposta = {
         "status": "processing",
         "message": "🎬 Renderização iniciada em segundo plano.",
         "output_file": output_name,
         "status_path": f"/workspace/output/{Path(output_name).stem}_status.json"
-    })
+    }
+    if modo_hls:
+        resposta["playlist"] = playlist_url
+    return JSONResponse(resposta)
 
 # ========================
 # ❤️ Ken Burns 2D
@@ -483,6 +568,11 @@ async def verificar_status_video(output_name: str):
     output_path = os.path.join(OUTPUT_DIR, video_name)
     status_file = os.path.join(OUTPUT_DIR, f"{base_name}_status.json")
 
+    # Renderização em modo HLS → acompanha a playlist em vez do .mp4
+    hls_playlist = os.path.join(OUTPUT_DIR, f"{base_name}_hls", HLS_PLAYLIST)
+    if not os.path.exists(output_path) and os.path.exists(hls_playlist):
+        output_path = hls_playlist
+
     # Caso ainda não tenha iniciado
     if not os.path.exists(output_path):
         return {
@@ -498,7 +588,9 @@ async def verificar_status_video(output_name: str):
                 data = json.load(f)
             data["arquivo"] = video_name
             data["path"] = output_path
-            data["tamanho_mb"] = round(os.path.getsize(output_path) / (1024 * 1024), 2)
+            data["tamanho_mb"] = tamanho_mb(
+                os.path.dirname(output_path) if output_path == hls_playlist else output_path
+            )
             return data
         except Exception as e:
             print(f"[WARN] Falha ao ler status JSON: {e}")
@@ -626,33 +718,49 @@ async def queimar_legenda(
 # ========================
 # 📥 ENDPOINT: /download
 # ========================
-@app.get("/download/{filename:path}")
-async def baixar_arquivo(filename: str):
+@app.api_route("/download/{filename:path}", methods=["GET", "HEAD"])
+async def baixar_arquivo(filename: str, request: Request):
     """
-    Permite baixar qualquer arquivo do diretório /workspace/output.
+    Permite baixar qualquer arquivo do diretório /workspace/output,
+    incluindo um nível de subdiretório (segmentos HLS em <nome>_hls/).
+    Range, If-Range e HEAD ficam a cargo do FileResponse;
+    If-None-Match / If-Modified-Since retornam 304.
     Exemplo:
     GET /download/video_final.mp4
+    GET /download/video_final_hls/index.m3u8
     """
     try:
-        # Garante que o nome seja seguro e dentro do diretório de saída
-        safe_name = os.path.basename(filename)
-        file_path = os.path.join(OUTPUT_DIR, safe_name)
-
-        if not os.path.exists(file_path):
+        # Garante que o caminho seja seguro e dentro do diretório de saída
+        partes = Path(filename).parts
+        output_root = os.path.realpath(OUTPUT_DIR)
+        file_path = os.path.realpath(os.path.join(output_root, *partes))
+        safe_name = os.path.basename(file_path)
+
+        if (
+            not 1 <= len(partes) <= 2
+            or os.path.commonpath([output_root, file_path]) != output_root
+            or not os.path.isfile(file_path)
+        ):
             return JSONResponse(
-                {"error": f"Arquivo não encontrado: {safe_name}"},
+                {"error": f"Arquivo não encontrado: {filename}"},
                 status_code=404
             )
 
-        return FileResponse(
+        response = FileResponse(
             path=file_path,
             filename=safe_name,
-            media_type="application/octet-stream"
+            media_type="application/octet-stream",
+            stat_result=os.stat(file_path)
         )
 
+        # Mesma regra do /output: ETag do FileResponse vs If-None-Match
+        if arquivos_output.is_not_modified(response.headers, request.headers):
+            return NotModifiedResponse(response.headers)
+
+        return response
+
     except Exception as e:
         return JSONResponse(
             {"error": str(e)},
             status_code=500
         )
-